@@ -1,22 +1,28 @@
 """Functions to support Landsat processing."""
 
-import json
 import logging
 import os
 from datetime import timedelta
 from pathlib import Path
 
 import geopandas as gpd
+import orjson
 import pandas as pd
 import pystac
-import pystac_client
+
+from stac_utils import geometries_from_geojson, open_stac_catalog
 
 
 LANDSAT_CATALOG_API = 'https://landsatlook.usgs.gov/stac-server'
-LANDSAT_CATALOG = pystac_client.Client.open(LANDSAT_CATALOG_API)
+LANDSAT_CATALOG = open_stac_catalog(LANDSAT_CATALOG_API)
 LANDSAT_COLLECTION_NAME = 'landsat-c2l1'
 LANDSAT_COLLECTION = LANDSAT_CATALOG.get_collection(LANDSAT_COLLECTION_NAME)
-LANDSAT_TILES_TO_PROCESS = json.loads((Path(__file__).parent / 'landsat_tiles_to_process.json').read_text())
+LANDSAT_TILES_TO_PROCESS = frozenset(
+    orjson.loads((Path(__file__).parent / 'landsat_tiles_to_process.json').read_bytes())
+)
+
+# Large enough that a secondary scene search for one path/row returns a single page
+LANDSAT_CATALOG_PAGE_SIZE = 1000
 
 LANDSAT_MAX_PAIR_SEPARATION_IN_DAYS = 544
 LANDSAT_MAX_CLOUD_COVER_PERCENT = 60
@@ -49,30 +55,32 @@ def qualifies_for_landsat_processing(
         A bool that is True if the scene qualifies for Landsat processing, else False.
     """
     if item.collection_id != LANDSAT_COLLECTION_NAME:
-        log.log(log_level, f'{item.id} disqualifies for processing because it is from the wrong collection')
+        log.log(log_level, '%s disqualifies for processing because it is from the wrong collection', item.id)
         return False
 
     if 'OLI' not in item.properties['instruments']:
-        log.log(log_level, f'{item.id} disqualifies for processing because it was not imaged with the right instrument')
+        log.log(
+            log_level, '%s disqualifies for processing because it was not imaged with the right instrument', item.id
+        )
         return False
 
     if item.properties['landsat:collection_category'] not in ['T1', 'T2']:
-        log.log(log_level, f'{item.id} disqualifies for processing because it is from the wrong tier')
+        log.log(log_level, '%s disqualifies for processing because it is from the wrong tier', item.id)
         return False
 
     if item.properties['landsat:wrs_path'] + item.properties['landsat:wrs_row'] not in LANDSAT_TILES_TO_PROCESS:
-        log.log(log_level, f'{item.id} disqualifies for processing because it is not from a tile containing land-ice')
+        log.log(log_level, '%s disqualifies for processing because it is not from a tile containing land-ice', item.id)
         return False
 
     if item.properties.get('landsat:cloud_cover_land', -1) < 0:
-        log.log(log_level, f'{item.id} disqualifies for processing because cloud coverage is unknown')
+        log.log(log_level, '%s disqualifies for processing because cloud coverage is unknown', item.id)
         return False
 
     if item.properties['landsat:cloud_cover_land'] > max_cloud_cover:
-        log.log(log_level, f'{item.id} disqualifies for processing because it has too much cloud cover')
+        log.log(log_level, '%s disqualifies for processing because it has too much cloud cover', item.id)
         return False
 
-    log.log(log_level, f'{item.id} qualifies for processing')
+    log.log(log_level, '%s qualifies for processing', item.id)
     return True
 
 
@@ -90,8 +98,9 @@ def get_landsat_pairs_for_reference_scene(
         max_cloud_cover: The maximum percent of the secondary scene that can be covered by clouds
 
     Returns:
-        A DataFrame with all potential pairs for a Landsat reference scene. Metadata in the columns will be for the
-        *secondary* scene unless specified otherwise.
+        A DataFrame with all potential pairs for a Landsat reference scene, with `reference`,
+        `reference_acquisition`, `secondary`, `datetime`, and `geometry` columns. The `datetime` and `geometry` are
+        for the *secondary* scene.
     """
     results = LANDSAT_CATALOG.search(
         collections=[reference.collection_id],
@@ -99,8 +108,13 @@ def get_landsat_pairs_for_reference_scene(
             f'landsat:wrs_path={reference.properties["landsat:wrs_path"]}',
             f'landsat:wrs_row={reference.properties["landsat:wrs_row"]}',
             'view:off_nadir>0' if reference.properties['view:off_nadir'] > 0 else 'view:off_nadir=0',
+            # Let the server drop scenes `qualifies_for_landsat_processing` would reject, so they aren't paged through
+            '{"landsat:collection_category": {"in": ["T1", "T2"]}}',
+            'landsat:cloud_cover_land>=0',
+            f'landsat:cloud_cover_land<={max_cloud_cover}',
         ],
         datetime=[reference.datetime - max_pair_separation, reference.datetime - timedelta(seconds=1)],
+        limit=LANDSAT_CATALOG_PAGE_SIZE,
     )
 
     items = [
@@ -110,19 +124,20 @@ def get_landsat_pairs_for_reference_scene(
         if qualifies_for_landsat_processing(item, max_cloud_cover=max_cloud_cover)
     ]
 
-    log.debug(f'Found {len(items)} secondary scenes for {reference.id}')
+    log.debug('Found %s secondary scenes for %s', len(items), reference.id)
     if len(items) == 0:
         return gpd.GeoDataFrame({'reference': [], 'secondary': []})
 
-    features = []
-    for item in items:
-        feature = item.to_dict()
-        feature['properties']['reference'] = reference.id
-        feature['properties']['reference_acquisition'] = reference.datetime
-        feature['properties']['secondary'] = item.id
-        features.append(feature)
-
-    df = gpd.GeoDataFrame.from_features(features)
-    df['datetime'] = pd.to_datetime(df.datetime, format='ISO8601')
+    # Only build the columns needed downstream, rather than a column for every STAC property of the secondary scenes
+    df = gpd.GeoDataFrame(
+        {
+            'reference': reference.id,
+            'reference_acquisition': reference.datetime,
+            'secondary': [item.id for item in items],
+            'datetime': pd.to_datetime([item.datetime for item in items]),
+        },
+        geometry=geometries_from_geojson(item.geometry for item in items),
+        crs='EPSG:4326',
+    )
 
     return df
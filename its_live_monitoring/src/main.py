@@ -5,6 +5,7 @@ import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
 
 import boto3
@@ -36,6 +37,17 @@ HYP3 = sdk.HyP3(
     password=EARTHDATA_PASSWORD,
 )
 
+# Each scene being processed holds its candidate secondary scenes in memory (~25-30 MB for a Sentinel-2 scene, on top of
+# ~130 MB of imports), so this bounds peak memory use, which must fit in the lambda's `MemorySize` in `cloudformation.yml`.
+# Each scene thread also holds at most one connection from `sentinel2.SESSION`'s pool at a time.
+MAX_CONCURRENT_SCENES = 4
+
+# HyP3 limits how many jobs can be submitted per request, so a scene's chunks of jobs are submitted concurrently. Every
+# scene being processed shares this executor, so at most `MAX_CONCURRENT_SUBMISSIONS` requests use `HYP3`'s session at
+# once, no matter how many scenes are being processed, which stays within the session's default pool of 10 connections.
+MAX_CONCURRENT_SUBMISSIONS = 4
+SUBMISSION_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SUBMISSIONS)
+
 log = logging.getLogger('its_live_monitoring')
 log.setLevel(os.environ.get('LOGGING_LEVEL', 'INFO'))
 
@@ -132,14 +144,16 @@ def format_time(time: datetime) -> str:
     return utc_time.isoformat(timespec='seconds')
 
 
-def query_jobs_by_status_code(status_code: str, user: str, name: str, start: datetime) -> sdk.Batch:
+def query_jobs_by_status_code(
+    status_code: str, user: str, name: str | None = None, start: datetime | None = None
+) -> sdk.Batch:
     """Query dynamodb for jobs by status_code, then filter by user, name, and date.
 
     Args:
         status_code: `status_code` of the desired jobs
         user: the `user_id` that submitted the jobs
-        name: the name of the jobs
-        start: the earliest submission date of the jobs
+        name: the name of the jobs; if not provided, jobs with any name are returned
+        start: the earliest submission date of the jobs; if not provided, jobs submitted at any time are returned
 
     Returns:
         sdk.Batch: batch of jobs matching the filters
@@ -148,7 +162,11 @@ def query_jobs_by_status_code(status_code: str, user: str, name: str, start: dat
 
     key_expression = Key('status_code').eq(status_code)
 
-    filter_expression = Attr('user_id').eq(user) & Attr('name').eq(name) & Attr('request_time').gte(format_time(start))
+    filter_expression = Attr('user_id').eq(user)
+    if name is not None:
+        filter_expression &= Attr('name').eq(name)
+    if start is not None:
+        filter_expression &= Attr('request_time').gte(format_time(start))
 
     params = {
         'IndexName': 'status_code',
@@ -168,41 +186,86 @@ def query_jobs_by_status_code(status_code: str, user: str, name: str, start: dat
     return sdk.Batch([sdk.Job.from_dict(job) for job in jobs])
 
 
-def deduplicate_hyp3_pairs(pairs: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def jobs_to_pairs(jobs: sdk.Batch) -> pd.DataFrame:
+    """Get the `reference` and `secondary` scenes of each job in a batch as a DataFrame."""
+    granules = [job.job_parameters['granules'] for job in jobs]
+    return pd.DataFrame(
+        {
+            'reference': [reference for reference, _ in granules],
+            'secondary': [secondary for _, secondary in granules],
+        }
+    )
+
+
+def get_in_progress_pairs(user: str, name: str | None = None, start: datetime | None = None) -> pd.DataFrame:
+    """Get the pairs of all PENDING and RUNNING HyP3 jobs submitted by a user.
+
+    Args:
+        user: the `user_id` that submitted the jobs
+        name: the name of the jobs; if not provided, jobs with any name are included
+        start: the earliest submission date of the jobs; if not provided, jobs submitted at any time are included
+
+    Returns:
+         A DataFrame with `reference` and `secondary` columns.
+    """
+    pending_jobs = query_jobs_by_status_code('PENDING', user, name=name, start=start)
+    running_jobs = query_jobs_by_status_code('RUNNING', user, name=name, start=start)
+    return jobs_to_pairs(pending_jobs + running_jobs)
+
+
+def get_acquisition_date(scene: str) -> datetime:
+    """Get the acquisition date (at midnight UTC) of a Landsat or Sentinel-2 scene from its name."""
+    date = scene.split('_')[2 if scene.startswith('S2') else 3][:8]
+    return datetime.strptime(date, '%Y%m%d').replace(tzinfo=UTC)
+
+
+def deduplicate_hyp3_pairs(pairs: gpd.GeoDataFrame, in_progress_pairs: pd.DataFrame | None = None) -> gpd.GeoDataFrame:
     """Search HyP3 jobs since the reference scene's acquisition date and remove already submitted (in PENDING or RUNNING state) pairs.
 
     Args:
          pairs: A GeoDataFrame containing *at least*  these columns: `reference`, `reference_acquisition`, and
           `secondary`.
+         in_progress_pairs: A DataFrame with the `reference` and `secondary` columns of already submitted pairs, as
+          returned by `get_in_progress_pairs`. If not provided, HyP3 will be searched for the reference scene's jobs.
 
     Returns:
          The pairs GeoDataFrame with any already submitted pairs removed.
     """
-    pending_jobs = query_jobs_by_status_code(
-        'PENDING', EARTHDATA_USERNAME, pairs.iloc[0].reference, pairs.iloc[0].reference_acquisition
-    )
-    running_jobs = query_jobs_by_status_code(
-        'RUNNING', EARTHDATA_USERNAME, pairs.iloc[0].reference, pairs.iloc[0].reference_acquisition
+    if len(pairs) == 0:
+        return pairs
+
+    if in_progress_pairs is None:
+        pending_jobs = query_jobs_by_status_code(
+            'PENDING', EARTHDATA_USERNAME, pairs.iloc[0].reference, pairs.iloc[0].reference_acquisition
+        )
+        running_jobs = query_jobs_by_status_code(
+            'RUNNING', EARTHDATA_USERNAME, pairs.iloc[0].reference, pairs.iloc[0].reference_acquisition
+        )
+        in_progress_pairs = jobs_to_pairs(pending_jobs + running_jobs)
+
+    # anti-join: keep only the pairs without a match in the in progress pairs
+    pairs = pairs.merge(
+        in_progress_pairs[['reference', 'secondary']].drop_duplicates(),
+        on=['reference', 'secondary'],
+        how='left',
+        indicator=True,
     )
-    jobs = pending_jobs + running_jobs
+    pairs = pairs[pairs['_merge'] == 'left_only'].drop(columns='_merge')
 
-    df = pd.DataFrame([job.job_parameters['granules'] for job in jobs], columns=['reference', 'secondary'])
-    df = df.set_index(['reference', 'secondary'])
-    pairs = pairs.set_index(['reference', 'secondary'])
+    return pairs.reset_index(drop=True)
 
-    duplicates = df.loc[df.index.isin(pairs.index)]
-    if len(duplicates) > 0:
-        pairs = pairs.drop(duplicates.index)
 
-    return pairs.reset_index()
+def submit_pairs_for_processing(pairs: gpd.GeoDataFrame) -> sdk.Batch:  # noqa: D103
+    if len(pairs) == 0:
+        return sdk.Batch()
 
+    publish_bucket = os.environ.get('PUBLISH_BUCKET', '')
 
-def submit_pairs_for_processing(pairs: gpd.GeoDataFrame) -> sdk.Batch:  # noqa: D103
     prepared_jobs = []
-    for reference, secondary in pairs[['reference', 'secondary']].itertuples(index=False):
+    for reference, secondary in zip(pairs['reference'].to_numpy(), pairs['secondary'].to_numpy()):
         prepared_job = HYP3.prepare_autorift_job(reference, secondary, name=reference)
 
-        if publish_bucket := os.environ.get('PUBLISH_BUCKET', ''):
+        if publish_bucket:
             prepared_job['job_parameters']['publish_bucket'] = publish_bucket
 
         prepared_jobs.append(prepared_job)
@@ -210,8 +273,8 @@ def submit_pairs_for_processing(pairs: gpd.GeoDataFrame) -> sdk.Batch:  # noqa:
     log.debug(prepared_jobs)
 
     jobs = sdk.Batch()
-    for batch in sdk.util.chunk(prepared_jobs):
-        jobs += HYP3.submit_prepared_jobs(batch)
+    for batch in SUBMISSION_EXECUTOR.map(HYP3.submit_prepared_jobs, sdk.util.chunk(prepared_jobs)):
+        jobs += batch
 
     return jobs
 
@@ -219,12 +282,14 @@ def submit_pairs_for_processing(pairs: gpd.GeoDataFrame) -> sdk.Batch:  # noqa:
 def process_scene(
     scene: str,
     submit: bool = True,
+    in_progress_pairs: pd.DataFrame | None = None,
 ) -> sdk.Batch:
     """Trigger Landsat processing for a scene.
 
     Args:
         scene: Reference Landsat scene name to build pairs for.
         submit: Submit pairs to HyP3 for processing.
+        in_progress_pairs: Already submitted pairs to deduplicate against; see `deduplicate_hyp3_pairs`.
 
     Returns:
         Jobs submitted to HyP3 for processing.
@@ -247,23 +312,26 @@ def process_scene(
     if pairs is None:
         return sdk.Batch()
 
-    log.info(f'Found {len(pairs)} pairs for {scene}')
-    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
-        log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
+    log.info('Found %s pairs for %s', len(pairs), scene)
+    if log.isEnabledFor(logging.DEBUG):
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
 
     if len(pairs) > 0:
-        pairs = deduplicate_hyp3_pairs(pairs)
+        pairs = deduplicate_hyp3_pairs(pairs, in_progress_pairs)
 
-        log.info(f'Deduplicated HyP3 running/pending pairs; {len(pairs)} remaining')
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
-            log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
+        log.info('Deduplicated HyP3 running/pending pairs; %s remaining', len(pairs))
+        if log.isEnabledFor(logging.DEBUG):
+            with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+                log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
 
     if len(pairs) > 0:
         pairs = deduplicate_s3_pairs(pairs)
 
-        log.info(f'Deduplicated already published pairs; {len(pairs)} remaining')
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
-            log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
+        log.info('Deduplicated already published pairs; %s remaining', len(pairs))
+        if log.isEnabledFor(logging.DEBUG):
+            with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+                log.debug(pairs.sort_values(by=['secondary'], ascending=False).loc[:, ['reference', 'secondary']])
 
     jobs = sdk.Batch()
     if submit:
@@ -286,15 +354,54 @@ def lambda_handler(event: dict, context: object) -> dict:
         AWS SQS batchItemFailures JSON response including messages that failed to be processed
     """
     batch_item_failures = []
+    message_ids_by_scene: dict[str, list[str]] = {}
     for record in event['Records']:
         try:
             body = json.loads(record['body'])
             message = json.loads(body['Message'])
             product_id = 'landsat_product_id' if 'landsat_product_id' in message.keys() else 'name'
-            _ = process_scene(message[product_id])
+            message_ids_by_scene.setdefault(message[product_id], []).append(record['messageId'])
         except Exception:
-            log.exception(f'Could not process message {record["messageId"]}')
+            log.exception('Could not process message %s', record['messageId'])
             batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    # Search HyP3 for in progress pairs once per invocation instead of once per scene. A scene's jobs can't have been
+    # submitted before it was acquired, so only jobs submitted since the earliest acquisition date are needed.
+    in_progress_pairs_by_scene: dict[str, pd.DataFrame] = {}
+    if message_ids_by_scene:
+        try:
+            start = min(get_acquisition_date(scene) for scene in message_ids_by_scene)
+            in_progress_pairs = get_in_progress_pairs(EARTHDATA_USERNAME, start=start)
+            in_progress_pairs_by_scene = dict.fromkeys(message_ids_by_scene, in_progress_pairs)
+        except Exception:
+            log.exception('Could not search HyP3 for in progress pairs; searching for each scene instead')
+
+    # NOTE: the boto3 `dynamo` resource isn't thread-safe, so if the search above failed, search HyP3 for each scene's
+    #  in progress pairs here, one scene at a time, instead of from the threads processing the scenes
+    for scene in [scene for scene in message_ids_by_scene if scene not in in_progress_pairs_by_scene]:
+        try:
+            in_progress_pairs_by_scene[scene] = get_in_progress_pairs(
+                EARTHDATA_USERNAME, name=scene, start=get_acquisition_date(scene)
+            )
+        except Exception:
+            log.exception('Could not search HyP3 for in progress pairs for %s', scene)
+            for message_id in message_ids_by_scene.pop(scene):
+                batch_item_failures.append({'itemIdentifier': message_id})
+
+    # Processing a scene is almost entirely waiting on network I/O, so process a few scenes concurrently.
+    # NOTE: each scene is only processed once, even if it's in multiple records, so its pairs aren't submitted twice
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCENES) as executor:
+        futures = {
+            executor.submit(process_scene, scene, in_progress_pairs=in_progress_pairs_by_scene[scene]): scene
+            for scene in message_ids_by_scene
+        }
+
+    for future, scene in futures.items():
+        if (exception := future.exception()) is not None:
+            for message_id in message_ids_by_scene[scene]:
+                log.error('Could not process message %s', message_id, exc_info=exception)
+                batch_item_failures.append({'itemIdentifier': message_id})
+
     return {'batchItemFailures': batch_item_failures}
 
 
@@ -1,30 +1,57 @@
 """Functions to support Sentinel-2 processing."""
 
-import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from functools import lru_cache
 from pathlib import Path
 
 import geopandas as gpd
+import orjson
 import pandas as pd
 import pystac
-import pystac_client
 import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from stac_utils import geometries_from_geojson, open_stac_catalog
 
 
 SENTINEL2_CATALOG_API = 'https://earth-search.aws.element84.com/v1/'
-SENTINEL2_CATALOG = pystac_client.Client.open(SENTINEL2_CATALOG_API)
+SENTINEL2_CATALOG = open_stac_catalog(SENTINEL2_CATALOG_API)
 SENTINEL2_COLLECTION_NAME = 'sentinel-2-l1c'
-SENTINEL2_COLLECTION = SENTINEL2_CATALOG.get_collection(SENTINEL2_COLLECTION_NAME)
-SENTINEL2_TILES_TO_PROCESS = json.loads((Path(__file__).parent / 'sentinel2_tiles_to_process.json').read_text())
+SENTINEL2_TILES_TO_PROCESS = frozenset(
+    orjson.loads((Path(__file__).parent / 'sentinel2_tiles_to_process.json').read_bytes())
+)
+
+# Large enough that a secondary scene search for one MGRS tile usually returns a single page
+SENTINEL2_CATALOG_PAGE_SIZE = 500
 
 SENTINEL2_MAX_PAIR_SEPARATION_IN_DAYS = 544
 SENTINEL2_MIN_PAIR_SEPARATION_IN_DAYS = 5
 SENTINEL2_MAX_CLOUD_COVER_PERCENT = 70
 SENTINEL2_MIN_DATA_COVERAGE = 70
+SENTINEL2_MAX_WORKERS = 10
+
+# Per host, so there's a connection for each `SENTINEL2_EXECUTOR` worker plus each reference scene being processed
+# concurrently (see `main.MAX_CONCURRENT_SCENES`); connections are only opened as they're needed
+SENTINEL2_SESSION_POOL_SIZE = 2 * SENTINEL2_MAX_WORKERS
 
 SESSION = requests.Session()
+SESSION.mount(
+    'https://',
+    HTTPAdapter(
+        pool_connections=2,  # Google Cloud Storage and the Sentinel-2 tile info bucket
+        pool_maxsize=SENTINEL2_SESSION_POOL_SIZE,
+        max_retries=Retry(
+            total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False
+        ),
+    ),
+)
+
+# Shared by every reference scene being processed concurrently, so at most `SENTINEL2_MAX_WORKERS` secondary scenes are
+# qualified at once in total, no matter how many reference scenes are being processed
+SENTINEL2_EXECUTOR = ThreadPoolExecutor(max_workers=SENTINEL2_MAX_WORKERS)
 
 log = logging.getLogger('its_live_monitoring')
 log.setLevel(os.environ.get('LOGGING_LEVEL', 'INFO'))
@@ -40,7 +67,7 @@ def raise_for_missing_in_google_cloud(scene_name: str) -> None:
     tile = f'{scene_name[39:41]}/{scene_name[41:42]}/{scene_name[42:44]}'
 
     manifest_url = f'{root_url}/{tile}/{scene_name}.SAFE/manifest.safe'
-    response = requests.head(manifest_url)
+    response = SESSION.head(manifest_url)
     response.raise_for_status()
 
 
@@ -54,10 +81,25 @@ def get_data_coverage_for_item(item: pystac.Item) -> float:
         data_coverage: The data coverage percentage as a float.
     """
     tile_info_path = item.assets['tileinfo_metadata'].href.replace('s3://', 'https://roda.sentinel-hub.com/')
+    return get_data_coverage_for_tile_info(tile_info_path)
+
 
+@lru_cache(maxsize=4096)
+def get_data_coverage_for_tile_info(tile_info_path: str) -> float:
+    """Gets the percentage of the tile covered by valid data from its tile info metadata.
+
+    A scene is a candidate secondary for every later scene of its tile and relative orbit, so results are cached for
+    the lifetime of the lambda container.
+
+    Args:
+        tile_info_path: The HTTPS URL of the scene's tileInfo.json metadata.
+
+    Returns:
+        data_coverage: The data coverage percentage as a float.
+    """
     response = SESSION.get(tile_info_path)
     response.raise_for_status()
-    data_coverage = response.json()['dataCoveragePercentage']
+    data_coverage = orjson.loads(response.content)['dataCoveragePercentage']
 
     return data_coverage
 
@@ -103,8 +145,9 @@ def is_new_scene(
         # Processing baselines: https://sentinels.copernicus.eu/web/sentinel/technical-guides/sentinel-2-msi/processing-baseline
         log.log(
             log_level,
-            f'{scene_name} disqualifies for processing because the processing baseline identifier '
+            '%s disqualifies for processing because the processing baseline identifier '
             'indicates it is a product from a reprocessing activity',
+            scene_name,
         )
         return False
     return True
@@ -113,7 +156,6 @@ def is_new_scene(
 def qualifies_for_sentinel2_processing(
     item: pystac.Item,
     *,
-    relative_orbit: str = None,
     max_cloud_cover: int = SENTINEL2_MAX_CLOUD_COVER_PERCENT,
     log_level: int = logging.DEBUG,
 ) -> bool:
@@ -121,64 +163,54 @@ def qualifies_for_sentinel2_processing(
 
     Args:
         item: STAC item of the desired Sentinel-2 scene.
-        relative_orbit: scene must be from this relative orbit if provided.
         max_cloud_cover: The maximum allowable percentage of cloud cover.
         log_level: The logging level
 
     Returns:
         A bool that is True if the scene qualifies for Sentinel-2 processing, else False.
     """
-    item_scene_id = item.properties['s2:product_uri'].removesuffix('.SAFE')
-
-    if relative_orbit is not None:
-        item_relative_orbit = item_scene_id.split('_')[4]
-        if item_relative_orbit != relative_orbit:
-            log.log(
-                log_level,
-                f'{item_scene_id} disqualifies for processing because its relative orbit ({item_relative_orbit}) '
-                f'does not match the required relative orbit ({relative_orbit}).',
-            )
-            return False
+    properties = item.properties
+    item_scene_id = properties['s2:product_uri'].removesuffix('.SAFE')
 
     if item.collection_id != SENTINEL2_COLLECTION_NAME:
-        log.log(log_level, f'{item_scene_id} disqualifies for processing because it is from the wrong collection')
+        log.log(log_level, '%s disqualifies for processing because it is from the wrong collection', item_scene_id)
         return False
 
-    if not is_new_scene(item_scene_id, log_level):
+    if properties['grid:code'] not in SENTINEL2_TILES_TO_PROCESS:
+        log.log(
+            log_level, '%s disqualifies for processing because it is not from a tile containing land-ice', item_scene_id
+        )
         return False
 
-    if not item.properties['s2:product_type'].endswith('1C'):
-        log.log(log_level, f'{item_scene_id} disqualifies for processing because it is the wrong product type.')
+    if not is_new_scene(item_scene_id, log_level):
         return False
 
-    if 'msi' not in item.properties['instruments']:
-        log.log(
-            log_level,
-            f'{item_scene_id} disqualifies for processing because it was not imaged with the right instrument',
-        )
+    if not properties['s2:product_type'].endswith('1C'):
+        log.log(log_level, '%s disqualifies for processing because it is the wrong product type.', item_scene_id)
         return False
 
-    grid_square = item.properties['grid:code']
-    if grid_square not in SENTINEL2_TILES_TO_PROCESS:
+    if 'msi' not in properties['instruments']:
         log.log(
             log_level,
-            f'{item_scene_id} disqualifies for processing because it is not from a tile containing land-ice',
+            '%s disqualifies for processing because it was not imaged with the right instrument',
+            item_scene_id,
         )
         return False
 
-    if item.properties.get('eo:cloud_cover', -1) < 0:
-        log.log(log_level, f'{item_scene_id} disqualifies for processing because cloud coverage is unknown')
+    cloud_cover = properties.get('eo:cloud_cover', -1)
+    if cloud_cover < 0:
+        log.log(log_level, '%s disqualifies for processing because cloud coverage is unknown', item_scene_id)
         return False
 
-    if item.properties['eo:cloud_cover'] > max_cloud_cover:
-        log.log(log_level, f'{item_scene_id} disqualifies for processing because it has too much cloud cover')
+    if cloud_cover > max_cloud_cover:
+        log.log(log_level, '%s disqualifies for processing because it has too much cloud cover', item_scene_id)
         return False
 
     if get_data_coverage_for_item(item) <= SENTINEL2_MIN_DATA_COVERAGE:
-        log.log(log_level, f'{item_scene_id} disqualifies for processing because it has too little data coverage.')
+        log.log(log_level, '%s disqualifies for processing because it has too little data coverage.', item_scene_id)
         return False
 
-    log.log(log_level, f'{item_scene_id} qualifies for processing')
+    log.log(log_level, '%s qualifies for processing', item_scene_id)
     return True
 
 
@@ -210,30 +242,43 @@ def get_sentinel2_pairs_for_reference_scene(
             f'eo:cloud_cover<={max_cloud_cover}',
         ],
         datetime=[reference.datetime - max_pair_separation, reference.datetime - min_pair_separation],
+        limit=SENTINEL2_CATALOG_PAGE_SIZE,
     )
 
     reference_scene_id = reference.properties['s2:product_uri'].removesuffix('.SAFE')
     reference_orbit = reference_scene_id.split('_')[4]
-    items = [
-        item
-        for page in results.pages()
-        for item in page
-        if qualifies_for_sentinel2_processing(item, relative_orbit=reference_orbit, max_cloud_cover=max_cloud_cover)
-    ]
-
-    log.debug(f'Found {len(items)} secondary scenes for {reference_scene_id}')
-    if len(items) == 0:
-        return gpd.GeoDataFrame({'reference': [], 'secondary': []})
 
-    features = []
-    for item in items:
-        feature = item.to_dict()
+    candidates = []
+    for feature in results.items_as_dicts():
+        # Most secondary scenes are rejected for being from a different relative orbit, so check that on the raw
+        # feature before paying to build a pystac Item from it; the relative orbit doesn't need to be checked again
+        secondary_scene_id = feature['properties']['s2:product_uri'].removesuffix('.SAFE')
+        if secondary_scene_id.split('_')[4] != reference_orbit:
+            log.debug(
+                '%s disqualifies for processing because it is from a different relative orbit', secondary_scene_id
+            )
+            continue
+
         feature['properties']['reference'] = reference_scene_id
         feature['properties']['reference_acquisition'] = reference.datetime
-        feature['properties']['secondary'] = item.properties['s2:product_uri'].removesuffix('.SAFE')
-        features.append(feature)
+        feature['properties']['secondary'] = secondary_scene_id
+        candidates.append(feature)
+
+    # Qualifying a scene may need to fetch its data coverage, so overlap those requests
+    qualifications = SENTINEL2_EXECUTOR.map(
+        lambda feature: qualifies_for_sentinel2_processing(
+            pystac.Item.from_dict(feature), max_cloud_cover=max_cloud_cover
+        ),
+        candidates,
+    )
+    features = [feature for feature, qualifies in zip(candidates, qualifications) if qualifies]
+
+    log.debug('Found %s secondary scenes for %s', len(features), reference_scene_id)
+    if len(features) == 0:
+        return gpd.GeoDataFrame({'reference': [], 'secondary': []})
 
-    df = gpd.GeoDataFrame.from_features(features)
+    geometries = geometries_from_geojson(feature['geometry'] for feature in features)
+    df = gpd.GeoDataFrame([feature['properties'] for feature in features], geometry=geometries, crs='EPSG:4326')
     df['datetime'] = pd.to_datetime(df.datetime, format='ISO8601')
 
     return df
@@ -0,0 +1,43 @@
+"""Functions shared by the Landsat and Sentinel-2 STAC catalog searches."""
+
+from collections.abc import Iterable
+
+import numpy as np
+import orjson
+import pystac_client
+import shapely
+from pystac_client.stac_api_io import StacApiIO
+from requests.adapters import Retry
+
+
+def open_stac_catalog(api_url: str) -> pystac_client.Client:
+    """Opens a STAC catalog that retries throttled and transient server errors with bounded exponential backoff.
+
+    Args:
+        api_url: The root URL of the STAC API.
+
+    Returns:
+        The opened STAC catalog client.
+    """
+    # STAC searches are POSTs, which urllib3 doesn't retry by default
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'POST'],
+        raise_on_status=False,
+    )
+    return pystac_client.Client.open(api_url, stac_io=StacApiIO(max_retries=retry))
+
+
+def geometries_from_geojson(geometries: Iterable[dict | None]) -> np.ndarray:
+    """Parses GeoJSON geometries into shapely geometries.
+
+    Args:
+        geometries: GeoJSON geometry dictionaries, which may be None for features without a geometry.
+
+    Returns:
+        An array of shapely geometries, with None for features without a geometry.
+    """
+    # Parse all geometries in one vectorized call instead of one `shapely.geometry.shape` call per geometry
+    return shapely.from_geojson([orjson.dumps(geometry) if geometry else None for geometry in geometries])
@@ -1,25 +1,34 @@
 """Lambda function to trigger Mattermost updates for Dead Letter Queue."""
 
 import argparse
+import json
 import logging
 import os
 import sys
+import urllib.request
 from datetime import UTC, datetime
-from pathlib import Path
 
 import boto3
-from mattermostdriver import Driver
 
 
 QUEUE_URL = os.environ['QUEUE_URL']
+QUEUE_NAME = QUEUE_URL.rsplit('/', 1)[-1]
+if 'test' in QUEUE_NAME:
+    EMPTY_QUEUE_EMOJI, NONEMPTY_QUEUE_EMOJI = ':heavy_check_mark:', ':heavy_multiplication_x:'
+else:
+    EMPTY_QUEUE_EMOJI, NONEMPTY_QUEUE_EMOJI = ':large_green_circle:', ':alert:'
+
 MATTERMOST_PAT = os.environ['MATTERMOST_PAT']
 
 # You can find the ID for a channel by looking in the channel info
 MATTERMOST_CHANNEL_ID = 'mmffdcqsafdg8xyr747scyuqnw'  # ~measures-its_live
+MATTERMOST_POSTS_URL = 'https://chat.asf.alaska.edu/api/v4/posts'
 
 log = logging.getLogger(__name__)
 log.setLevel(os.environ.get('LOGGING_LEVEL', 'INFO'))
 
+sqs = boto3.client('sqs')
+
 
 def get_queue_count() -> str:
     """Retrieve the message count of the Dead Letter Queue.
@@ -27,14 +36,32 @@ def get_queue_count() -> str:
     Returns:
         number_of_messages: count for Dead Letter Queue messages
     """
-    client = boto3.client('sqs')
-    result = client.get_queue_attributes(
+    result = sqs.get_queue_attributes(
         QueueUrl=QUEUE_URL,
-        AttributeNames=['All'],
+        AttributeNames=['ApproximateNumberOfMessages'],
     )
     return result['Attributes']['ApproximateNumberOfMessages']
 
 
+def create_post(message: str) -> dict:
+    """Posts a message to the Mattermost channel.
+
+    Args:
+        message: The message to post
+
+    Returns:
+        post: The created Mattermost post
+    """
+    request = urllib.request.Request(
+        MATTERMOST_POSTS_URL,
+        data=json.dumps({'channel_id': MATTERMOST_CHANNEL_ID, 'message': message}).encode(),
+        headers={'Authorization': f'Bearer {MATTERMOST_PAT}', 'Content-Type': 'application/json'},
+        method='POST',
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+
 def lambda_handler(event: dict, context: dict) -> None:
     """Posts a message to Mattermost with the Dead Letter Queue count.
 
@@ -45,30 +72,17 @@ def lambda_handler(event: dict, context: dict) -> None:
     Returns:
         None
     """
-    mattermost = Driver({'url': 'chat.asf.alaska.edu', 'token': MATTERMOST_PAT, 'scheme': 'https', 'port': 443})
-    response = mattermost.login()
-    log.debug(response)
-
     dead_letter_queue_count = int(get_queue_count())
 
-    queue_name = Path(QUEUE_URL).name
-    if 'test' in queue_name:
-        status_emoji = ':heavy_multiplication_x:' if dead_letter_queue_count != 0 else ':heavy_check_mark:'
-    else:
-        status_emoji = ':alert:' if dead_letter_queue_count != 0 else ':large_green_circle:'
+    status_emoji = NONEMPTY_QUEUE_EMOJI if dead_letter_queue_count != 0 else EMPTY_QUEUE_EMOJI
 
     mattermost_message = (
-        f'{status_emoji} Dead Letter Queue Count for `{queue_name}` has '
+        f'{status_emoji} Dead Letter Queue Count for `{QUEUE_NAME}` has '
         f'{dead_letter_queue_count} entries on {datetime.now(tz=UTC).isoformat()}'
     )
 
-    log.info(f'Posting: "{mattermost_message}" to {MATTERMOST_CHANNEL_ID}')
-    response = mattermost.posts.create_post(
-        options={
-            'channel_id': MATTERMOST_CHANNEL_ID,
-            'message': mattermost_message,
-        }
-    )
+    log.info('Posting: "%s" to %s', mattermost_message, MATTERMOST_CHANNEL_ID)
+    response = create_post(mattermost_message)
     log.debug(response)
 
 
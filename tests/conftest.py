@@ -1,7 +1,7 @@
 import datetime as dt
 from copy import deepcopy
 from os import environ
-from unittest.mock import NonCallableMock
+from types import SimpleNamespace
 
 import boto3
 import hyp3_sdk as sdk
@@ -11,7 +11,7 @@ from dateutil.parser import parse as date_parser
 from moto import mock_aws
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def pystac_item_factory():
     def create_pystac_item(
         id: str,
@@ -40,27 +40,26 @@ def pystac_item_factory():
     return create_pystac_item
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def stac_search_factory():
-    class MockItemSearch:
-        def __init__(self, items: list[pystac.item.Item]):
-            self.items = items
-
-        def pages(self):
-            return [self.items]
+    def create_item_search(items: list[pystac.item.Item]) -> SimpleNamespace:
+        return SimpleNamespace(
+            pages=lambda: [items],
+            items_as_dicts=lambda: [item.clone().to_dict() for item in items],
+        )
 
-    return MockItemSearch
+    return create_item_search
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def hyp3_job_factory():
-    def create_hyp3_job(granules: list) -> sdk.Job:
-        return NonCallableMock(job_parameters={'granules': granules})
+    def create_hyp3_job(granules: list) -> SimpleNamespace:
+        return SimpleNamespace(job_parameters={'granules': granules})
 
     return create_hyp3_job
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def hyp3_batch_factory(hyp3_job_factory):
     def create_hyp3_batch(granules_list: list) -> sdk.Batch:
         return sdk.Batch([hyp3_job_factory(granules) for granules in granules_list])
@@ -69,7 +68,7 @@ def hyp3_batch_factory(hyp3_job_factory):
 
 
 @mock_aws
-@pytest.fixture
+@pytest.fixture(scope='module')
 def tables():
     table_properties = {
         'BillingMode': 'PAY_PER_REQUEST',
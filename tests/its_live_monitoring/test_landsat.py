@@ -1,14 +1,15 @@
-from copy import deepcopy
 from datetime import UTC, datetime
 from unittest.mock import patch
 
+import pytest
+from shapely.geometry import shape
+
 import landsat
 
 
-@patch('landsat.LANDSAT_COLLECTION.get_item')
-def test_get_landsat_stac_item(mock_landsat_get_item, pystac_item_factory):
-    scene = 'LC08_L1TP_138041_20240128_20240207_02_T1'
-    properties = {
+@pytest.fixture(scope='module')
+def landsat_properties():
+    return {
         'instruments': ['OLI'],
         'landsat:collection_category': 'T1',
         'landsat:wrs_path': '001',
@@ -16,107 +17,60 @@ def test_get_landsat_stac_item(mock_landsat_get_item, pystac_item_factory):
         'landsat:cloud_cover_land': 50,
         'view:off_nadir': 0,
     }
-    collection = 'landsat-c2l1'
-    expected_item = pystac_item_factory(id=scene, datetime=datetime.now(), properties=properties, collection=collection)
-
-    mock_landsat_get_item.side_effect = [expected_item]
-    item = landsat.get_landsat_stac_item(scene)
-    assert item.collection_id == collection
-    assert item.properties == properties
-
 
-def test_qualifies_for_processing(pystac_item_factory):
-    properties = {
-        'instruments': ['OLI'],
-        'landsat:collection_category': 'T1',
-        'landsat:wrs_path': '001',
-        'landsat:wrs_row': '005',
-        'landsat:cloud_cover_land': 50,
-        'view:off_nadir': 0,
-    }
-    collection = 'landsat-c2l1'
 
-    good_item = pystac_item_factory(
-        id='landsat-scene', datetime=datetime.now(), properties=properties, collection=collection
+@pytest.fixture(scope='module')
+def landsat_reference_item(pystac_item_factory, landsat_properties):
+    return pystac_item_factory(
+        id='LC08_L1TP_138041_20240128_20240207_02_T1',
+        datetime='2024-01-28T04:29:49.361022Z',
+        properties=landsat_properties,
+        collection='landsat-c2l1',
     )
-    assert landsat.qualifies_for_landsat_processing(good_item)
-
-    item = deepcopy(good_item)
-    item.collection_id = 'foo'
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['instruments'] = ['TIRS']
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:collection_category'] = 'T2'
-    assert landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:collection_category'] = 'RT'
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:wrs_path'] = 'foo'
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:wrs_row'] = 'foo'
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    del item.properties['landsat:cloud_cover_land']
-    assert not landsat.qualifies_for_landsat_processing(item)
 
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = -1
-    assert not landsat.qualifies_for_landsat_processing(item)
 
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = 0
-    assert landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = 1
-    assert landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT - 1
-    assert landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT
-    assert landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['landsat:cloud_cover_land'] = landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT + 1
-    assert not landsat.qualifies_for_landsat_processing(item)
-
-    item = deepcopy(good_item)
-    item.properties['view:off_nadir'] = 14.065
-    assert landsat.qualifies_for_landsat_processing(item)
-
-
-@patch('landsat.LANDSAT_CATALOG.search')
-def test_get_landsat_pairs_for_reference_scene(mock_landsat_get_item, pystac_item_factory, stac_search_factory):
-    properties = {
-        'instruments': ['OLI'],
-        'landsat:collection_category': 'T1',
-        'landsat:wrs_path': '001',
-        'landsat:wrs_row': '005',
-        'landsat:cloud_cover_land': 50,
-        'view:off_nadir': 0,
-    }
-    collection = 'landsat-c2l1'
+@patch('landsat.LANDSAT_COLLECTION.get_item')
+def test_get_landsat_stac_item(mock_landsat_get_item, landsat_properties, landsat_reference_item):
+    scene = landsat_reference_item.id
 
-    ref_item = pystac_item_factory(
-        id='LC08_L1TP_138041_20240128_20240207_02_T1',
-        datetime='2024-01-28T04:29:49.361022Z',
-        properties=properties,
-        collection=collection,
+    mock_landsat_get_item.return_value = landsat_reference_item
+    item = landsat.get_landsat_stac_item(scene)
+    assert item.collection_id == 'landsat-c2l1'
+    assert item.properties == landsat_properties
+
+
+@pytest.mark.parametrize(
+    ('collection', 'overrides', 'qualifies'),
+    [
+        ('landsat-c2l1', {}, True),
+        ('foo', {}, False),
+        ('landsat-c2l1', {'instruments': ['TIRS']}, False),
+        ('landsat-c2l1', {'landsat:collection_category': 'T2'}, True),
+        ('landsat-c2l1', {'landsat:collection_category': 'RT'}, False),
+        ('landsat-c2l1', {'landsat:wrs_path': 'foo'}, False),
+        ('landsat-c2l1', {'landsat:wrs_row': 'foo'}, False),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': None}, False),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': -1}, False),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': 0}, True),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': 1}, True),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT - 1}, True),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT}, True),
+        ('landsat-c2l1', {'landsat:cloud_cover_land': landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT + 1}, False),
+        ('landsat-c2l1', {'view:off_nadir': 14.065}, True),
+    ],
+)
+def test_qualifies_for_processing(pystac_item_factory, landsat_properties, collection, overrides, qualifies):
+    # an override of None removes the property from the item
+    properties = {key: value for key, value in (landsat_properties | overrides).items() if value is not None}
+
+    item = pystac_item_factory(
+        id='landsat-scene', datetime=datetime.now(), properties=properties, collection=collection
     )
+    assert landsat.qualifies_for_landsat_processing(item) is qualifies
 
+
+@pytest.fixture
+def landsat_sec_items(pystac_item_factory, landsat_properties, landsat_reference_item):
     sec_scenes = [
         'LC09_L1TP_138041_20240120_20240120_02_T1',
         'LC08_L1TP_138041_20240112_20240123_02_T1',
@@ -127,34 +81,66 @@ def test_get_landsat_pairs_for_reference_scene(mock_landsat_get_item, pystac_ite
         datetime(2024, 1, 12, 4, 29, 55, tzinfo=UTC),
         datetime(2024, 1, 4, 4, 30, 3, 184014, tzinfo=UTC),
     ]
-    sec_items = []
-    for scene, date_time in zip(sec_scenes, sec_date_times):
-        sec_items.append(
-            pystac_item_factory(id=scene, datetime=date_time, properties=properties, collection=collection)
+    sec_geometries = [
+        {
+            'type': 'Polygon',
+            'coordinates': [
+                [
+                    [90.5, 29.4],
+                    [92.4, 29.0],
+                    [92.9, 30.8],
+                    [91.0, 31.2],
+                    [90.5, 29.4],
+                ]
+            ],
+        },
+        None,
+        None,
+    ]
+    return [
+        pystac_item_factory(
+            id=scene,
+            datetime=date_time,
+            properties=landsat_properties,
+            collection=landsat_reference_item.collection_id,
+            geometry=geometry,
         )
+        for scene, date_time, geometry in zip(sec_scenes, sec_date_times, sec_geometries)
+    ]
+
+
+@patch('landsat.LANDSAT_CATALOG.search')
+def test_get_landsat_pairs_for_reference_scene(
+    mock_landsat_get_item, stac_search_factory, landsat_reference_item, landsat_sec_items
+):
+    ref_item = landsat_reference_item
 
-    mock_landsat_get_item.side_effect = [stac_search_factory(sec_items)]
+    mock_landsat_get_item.return_value = stac_search_factory(landsat_sec_items)
     df = landsat.get_landsat_pairs_for_reference_scene(ref_item)
 
-    assert (df['landsat:wrs_path'] == ref_item.properties['landsat:wrs_path']).all()
-    assert (df['landsat:wrs_row'] == ref_item.properties['landsat:wrs_row']).all()
-    assert (df['view:off_nadir'] == ref_item.properties['view:off_nadir']).all()
-    assert (df['instruments'].apply(lambda x: ''.join(x)) == ''.join(ref_item.properties['instruments'])).all()
+    assert mock_landsat_get_item.call_args.kwargs['query'] == [
+        'landsat:wrs_path=001',
+        'landsat:wrs_row=005',
+        'view:off_nadir=0',
+        '{"landsat:collection_category": {"in": ["T1", "T2"]}}',
+        'landsat:cloud_cover_land>=0',
+        f'landsat:cloud_cover_land<={landsat.LANDSAT_MAX_CLOUD_COVER_PERCENT}',
+    ]
+    assert list(df.columns) == ['reference', 'reference_acquisition', 'secondary', 'datetime', 'geometry']
     assert (df['reference'] == ref_item.id).all()
+    assert (df['reference_acquisition'] == ref_item.datetime).all()
+    assert list(df['secondary']) == [item.id for item in landsat_sec_items]
+    assert list(df['datetime']) == [item.datetime for item in landsat_sec_items]
+    assert df.crs == 'EPSG:4326'
+    assert df.geometry.iloc[0].equals(shape(landsat_sec_items[0].geometry))
+    assert df.geometry.iloc[1:].isna().all()
 
 
 @patch('landsat.LANDSAT_CATALOG.search')
 def test_get_landsat_pairs_for_off_nadir_reference_scene(
-    mock_landsat_get_item, pystac_item_factory, stac_search_factory
+    mock_landsat_get_item, pystac_item_factory, stac_search_factory, landsat_properties
 ):
-    properties = {
-        'instruments': ['OLI'],
-        'landsat:collection_category': 'T1',
-        'landsat:wrs_path': '001',
-        'landsat:wrs_row': '005',
-        'landsat:cloud_cover_land': 50,
-        'view:off_nadir': 14.065,
-    }
+    properties = landsat_properties | {'view:off_nadir': 14.065}
     collection = 'landsat-c2l1'
 
     ref_item = pystac_item_factory(
@@ -173,16 +159,13 @@ def test_get_landsat_pairs_for_off_nadir_reference_scene(
     sec_off_nadir_angles = [14.049, 14.147, 14.100]
     sec_items = []
     for scene, date_time, off_nadir in zip(sec_scenes, sec_date_times, sec_off_nadir_angles):
-        props = deepcopy(properties)
-        props['view:off_nadir'] = off_nadir
+        props = properties | {'view:off_nadir': off_nadir}
         sec_items.append(pystac_item_factory(id=scene, datetime=date_time, properties=props, collection=collection))
 
-    mock_landsat_get_item.side_effect = [stac_search_factory(sec_items)]
+    mock_landsat_get_item.return_value = stac_search_factory(sec_items)
     df = landsat.get_landsat_pairs_for_reference_scene(ref_item)
 
-    assert (df['view:off_nadir'] > 0).all()
+    assert 'view:off_nadir>0' in mock_landsat_get_item.call_args.kwargs['query']
 
-    assert (df['landsat:wrs_path'] == ref_item.properties['landsat:wrs_path']).all()
-    assert (df['landsat:wrs_row'] == ref_item.properties['landsat:wrs_row']).all()
-    assert (df['instruments'].apply(lambda x: ''.join(x)) == ''.join(ref_item.properties['instruments'])).all()
     assert (df['reference'] == ref_item.id).all()
+    assert list(df['secondary']) == sec_scenes
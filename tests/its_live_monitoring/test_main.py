@@ -1,48 +1,129 @@
 import datetime
+import json
+import threading
 from unittest.mock import patch
 
 import geopandas as gpd
 import hyp3_sdk as sdk
+import pandas as pd
+import pytest
 from shapely import Polygon
 
 import main
 
 
-def test_point_to_region():
-    assert main.point_to_region(63.0, 128.0) == 'N60E120'
-    assert main.point_to_region(-63.0, 128.0) == 'S60E120'
-    assert main.point_to_region(63.0, -128.0) == 'N60W120'
-    assert main.point_to_region(-63.0, -128.0) == 'S60W120'
-    assert main.point_to_region(0.0, 128.0) == 'N00E120'
-    assert main.point_to_region(0.0, -128.0) == 'N00W120'
-    assert main.point_to_region(63.0, 0.0) == 'N60E000'
-    assert main.point_to_region(-63.0, 0.0) == 'S60E000'
-    assert main.point_to_region(0.0, 0.0) == 'N00E000'
-    # particularly weird edge cases which can arise if you round the point before passing it in
-    assert main.point_to_region(-0.0, 0.0) == 'S00E000'
-    assert main.point_to_region(-0.0, -0.0) == 'S00W000'
-    assert main.point_to_region(0.0, -0.0) == 'N00W000'
-
-
-def test_regions_from_bounds():
-    assert main.regions_from_bounds(-128.0, -63.0, -109.0, -54.0) == {
-        'S60W120',
-        'S60W110',
-        'S60W100',
-        'S50W120',
-        'S50W110',
-        'S50W100',
-    }
-    assert main.regions_from_bounds(-5.0, -5.0, 5.0, 5.0) == {'S00W000', 'S00E000', 'N00W000', 'N00E000'}
-    assert main.regions_from_bounds(104.0, 53.0, 123.0, 61.0) == {
-        'N60E120',
-        'N60E110',
-        'N60E100',
-        'N50E120',
-        'N50E110',
-        'N50E100',
-    }
-    assert main.regions_from_bounds(-128.0, -63.0, -128.0, -63.0) == {'S60W120'}
+LANDSAT_REF_SCENES = ['LC08_L1TP_138041_20240128_20240207_02_T1'] * 3
+LANDSAT_SEC_SCENES = [
+    'LC09_L1TP_138041_20240120_20240120_02_T1',
+    'LC08_L1TP_138041_20240112_20240123_02_T1',
+    'LC09_L1TP_138041_20240104_20240104_02_T1',
+]
+
+LANDSAT_REF_ACQUISITIONS = ['2024-01-28T04:29:49.361022Z'] * 3
+
+UNIT_SQUARE = Polygon.from_bounds(0, 0, 1, 1)
+
+EMPTY_BATCH = sdk.Batch()
+
+JOBS_TABLE_ITEMS = [
+    {
+        'job_id': 'job1',
+        'user_id': 'hyp3.its_live',
+        'status_code': 'PENDING',
+        'request_time': '2024-01-28T00:00:00+00:00',
+        'job_type': 'AUTORIFT',
+        'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
+    },
+    {
+        'job_id': 'job2',
+        'user_id': 'hyp3.its_live',
+        'status_code': 'PENDING',
+        'request_time': '2024-01-29T00:00:00+00:00',
+        'job_type': 'AUTORIFT',
+        'name': 'LC09_L1TP_138041_20240120_20240120_02_T2',
+    },
+    {
+        'job_id': 'job3',
+        'user_id': 'hyp3.its_live',
+        'status_code': 'PENDING',
+        'request_time': '2024-01-01T00:00:00+00:00',
+        'job_type': 'AUTORIFT',
+        'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
+    },
+    {
+        'job_id': 'job4',
+        'user_id': 'other-user',
+        'status_code': 'PENDING',
+        'request_time': '2024-01-29T00:00:00+00:00',
+        'job_type': 'AUTORIFT',
+        'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
+    },
+    {
+        'job_id': 'job5',
+        'user_id': 'other-user',
+        'status_code': 'RUNNING',
+        'request_time': '2024-01-29T00:00:00+00:00',
+        'job_type': 'AUTORIFT',
+        'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
+    },
+]
+
+
+@pytest.fixture(scope='module')
+def landsat_pairs():
+    return gpd.GeoDataFrame(
+        {
+            'reference': LANDSAT_REF_SCENES,
+            'secondary': LANDSAT_SEC_SCENES,
+            'reference_acquisition': LANDSAT_REF_ACQUISITIONS,
+        }
+    )
+
+
+@pytest.fixture(scope='module')
+def landsat_jobs(hyp3_batch_factory):
+    return hyp3_batch_factory(zip(LANDSAT_REF_SCENES, LANDSAT_SEC_SCENES))
+
+
+@pytest.mark.parametrize(
+    ('lat', 'lon', 'region'),
+    [
+        (63.0, 128.0, 'N60E120'),
+        (-63.0, 128.0, 'S60E120'),
+        (63.0, -128.0, 'N60W120'),
+        (-63.0, -128.0, 'S60W120'),
+        (0.0, 128.0, 'N00E120'),
+        (0.0, -128.0, 'N00W120'),
+        (63.0, 0.0, 'N60E000'),
+        (-63.0, 0.0, 'S60E000'),
+        (0.0, 0.0, 'N00E000'),
+        # particularly weird edge cases which can arise if you round the point before passing it in
+        (-0.0, 0.0, 'S00E000'),
+        (-0.0, -0.0, 'S00W000'),
+        (0.0, -0.0, 'N00W000'),
+    ],
+)
+def test_point_to_region(lat, lon, region):
+    assert main.point_to_region(lat, lon) == region
+
+
+@pytest.mark.parametrize(
+    ('bounds', 'regions'),
+    [
+        (
+            (-128.0, -63.0, -109.0, -54.0),
+            frozenset({'S60W120', 'S60W110', 'S60W100', 'S50W120', 'S50W110', 'S50W100'}),
+        ),
+        ((-5.0, -5.0, 5.0, 5.0), frozenset({'S00W000', 'S00E000', 'N00W000', 'N00E000'})),
+        (
+            (104.0, 53.0, 123.0, 61.0),
+            frozenset({'N60E120', 'N60E110', 'N60E100', 'N50E120', 'N50E110', 'N50E100'}),
+        ),
+        ((-128.0, -63.0, -128.0, -63.0), frozenset({'S60W120'})),
+    ],
+)
+def test_regions_from_bounds(bounds, regions):
+    assert main.regions_from_bounds(*bounds) == regions
 
 
 @patch('main.s3.list_objects_v2')
@@ -63,54 +144,159 @@ def test_get_key(mock_list_objects_v2):
 
 
 @patch('main.query_jobs_by_status_code')
-def test_deduplicate_hyp3_pairs(mock_query_jobs_by_status_code, hyp3_batch_factory):
-    sec_scenes = [
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        'LC08_L1TP_138041_20240112_20240123_02_T1',
-        'LC09_L1TP_138041_20240104_20240104_02_T1',
-    ]
-    ref_scenes = ['LC08_L1TP_138041_20240128_20240207_02_T1'] * 3
-    ref_acquisitions = ['2024-01-28T04:29:49.361022Z'] * 3
-
-    landsat_pairs = gpd.GeoDataFrame(
-        {'reference': ref_scenes, 'secondary': sec_scenes, 'reference_acquisition': ref_acquisitions}
-    )
+def test_deduplicate_hyp3_pairs(mock_query_jobs_by_status_code, landsat_pairs, landsat_jobs):
+    pairs = main.deduplicate_hyp3_pairs(landsat_pairs.iloc[0:0])
+    assert len(pairs) == 0
+    mock_query_jobs_by_status_code.assert_not_called()
 
-    mock_query_jobs_by_status_code.side_effect = [sdk.Batch(), sdk.Batch()]
+    mock_query_jobs_by_status_code.side_effect = [EMPTY_BATCH, EMPTY_BATCH]
     pairs = main.deduplicate_hyp3_pairs(landsat_pairs)
     assert pairs.equals(landsat_pairs)
 
-    mock_query_jobs_by_status_code.side_effect = [hyp3_batch_factory(zip(ref_scenes, sec_scenes)), sdk.Batch()]
+    mock_query_jobs_by_status_code.side_effect = [landsat_jobs, EMPTY_BATCH]
     pairs = main.deduplicate_hyp3_pairs(landsat_pairs)
     assert len(pairs) == 0
 
-    mock_query_jobs_by_status_code.side_effect = [
-        hyp3_batch_factory(zip(ref_scenes[:-1], sec_scenes[:-1])),
-        sdk.Batch(),
-    ]
+    mock_query_jobs_by_status_code.side_effect = [landsat_jobs[:-1], EMPTY_BATCH]
     pairs = main.deduplicate_hyp3_pairs(landsat_pairs)
     assert len(pairs) == 1
 
 
-@patch('main.get_key')
-def test_deduplicate_s3_pairs(mock_get_key):
-    sec_scenes = [
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        'LC08_L1TP_138041_20240112_20240123_02_T1',
-        'LC09_L1TP_138041_20240104_20240104_02_T1',
+@patch('main.query_jobs_by_status_code')
+def test_deduplicate_hyp3_pairs_with_in_progress_pairs(mock_query_jobs_by_status_code, landsat_pairs):
+    pairs = main.deduplicate_hyp3_pairs(landsat_pairs, pd.DataFrame(columns=['reference', 'secondary']))
+    assert pairs.equals(landsat_pairs)
+
+    in_progress_pairs = pd.DataFrame({'reference': LANDSAT_REF_SCENES[1:], 'secondary': LANDSAT_SEC_SCENES[1:]})
+    pairs = main.deduplicate_hyp3_pairs(landsat_pairs, in_progress_pairs)
+    assert pairs.equals(landsat_pairs.drop([1, 2]))
+
+    mock_query_jobs_by_status_code.assert_not_called()
+
+
+@patch('main.query_jobs_by_status_code')
+def test_get_in_progress_pairs(mock_query_jobs_by_status_code, hyp3_batch_factory):
+    mock_query_jobs_by_status_code.side_effect = [
+        hyp3_batch_factory([['ref1', 'sec1'], ['ref2', 'sec2']]),
+        hyp3_batch_factory([['ref3', 'sec3']]),
+    ]
+    start = datetime.datetime(2024, 1, 28, tzinfo=datetime.UTC)
+    pairs = main.get_in_progress_pairs('user', start=start)
+    assert pairs.equals(pd.DataFrame({'reference': ['ref1', 'ref2', 'ref3'], 'secondary': ['sec1', 'sec2', 'sec3']}))
+    assert [call.args for call in mock_query_jobs_by_status_code.call_args_list] == [
+        ('PENDING', 'user'),
+        ('RUNNING', 'user'),
+    ]
+    assert [call.kwargs for call in mock_query_jobs_by_status_code.call_args_list] == [
+        {'name': None, 'start': start},
+        {'name': None, 'start': start},
     ]
-    ref_scenes = ['LC08_L1TP_138041_20240128_20240207_02_T1'] * 3
-    ref_acquisitions = ['2024-01-28T04:29:49.361022Z'] * 3
-    geometries = [Polygon.from_bounds(0, 0, 1, 1)] * 3
 
-    landsat_pairs = gpd.GeoDataFrame(
-        {
-            'reference': ref_scenes,
-            'secondary': sec_scenes,
-            'reference_acquisition': ref_acquisitions,
-            'geometry': geometries,
-        }
+
+@pytest.mark.parametrize(
+    ('scene', 'acquisition_date'),
+    [
+        ('LC08_L1TP_138041_20240128_20240207_02_T1', datetime.datetime(2024, 1, 28, tzinfo=datetime.UTC)),
+        (
+            'S2B_MSIL1C_20240528T000000_N0510_R110_T22TCR_20240528T000000',
+            datetime.datetime(2024, 5, 28, tzinfo=datetime.UTC),
+        ),
+    ],
+)
+def test_get_acquisition_date(scene, acquisition_date):
+    assert main.get_acquisition_date(scene) == acquisition_date
+
+
+LAMBDA_HANDLER_SCENES = [
+    'LC08_L1TP_138041_20240128_20240207_02_T1',
+    'LC09_L1TP_138041_20240120_20240120_02_T1',
+    'S2B_MSIL1C_20240528T000000_N0510_R110_T22TCR_20240528T000000',
+]
+
+
+def lambda_handler_records():
+    scene1, scene2, scene3 = LAMBDA_HANDLER_SCENES
+    return [
+        {'messageId': 'message1', 'body': json.dumps({'Message': json.dumps({'landsat_product_id': scene1})})},
+        {'messageId': 'message2', 'body': json.dumps({'Message': json.dumps({'landsat_product_id': scene2})})},
+        {'messageId': 'message3', 'body': json.dumps({'Message': json.dumps({'name': scene3})})},
+        {'messageId': 'message4', 'body': json.dumps({'Message': json.dumps({'landsat_product_id': scene2})})},
+        {'messageId': 'message5', 'body': 'not json'},
+    ]
+
+
+def failing_process_scene(scene, in_progress_pairs):
+    if scene == LAMBDA_HANDLER_SCENES[1]:
+        raise ValueError()
+    return sdk.Batch()
+
+
+@patch('main.process_scene')
+@patch('main.get_in_progress_pairs')
+def test_lambda_handler(mock_get_in_progress_pairs, mock_process_scene):
+    in_progress_pairs = pd.DataFrame({'reference': ['ref1'], 'secondary': ['sec1']})
+    mock_get_in_progress_pairs.return_value = in_progress_pairs
+    mock_process_scene.side_effect = failing_process_scene
+
+    response = main.lambda_handler({'Records': lambda_handler_records()}, None)
+
+    assert response == {
+        'batchItemFailures': [
+            {'itemIdentifier': 'message5'},
+            {'itemIdentifier': 'message2'},
+            {'itemIdentifier': 'message4'},
+        ]
+    }
+    mock_get_in_progress_pairs.assert_called_once_with(
+        main.EARTHDATA_USERNAME, start=datetime.datetime(2024, 1, 20, tzinfo=datetime.UTC)
     )
+    assert sorted(call.args[0] for call in mock_process_scene.call_args_list) == sorted(LAMBDA_HANDLER_SCENES)
+    for call in mock_process_scene.call_args_list:
+        assert call.kwargs['in_progress_pairs'] is in_progress_pairs
+
+
+@patch('main.process_scene')
+@patch('main.get_in_progress_pairs')
+def test_lambda_handler_in_progress_pairs_failure(mock_get_in_progress_pairs, mock_process_scene):
+    search_threads = []
+
+    def get_in_progress_pairs(user, name=None, start=None):
+        search_threads.append(threading.current_thread())
+        if name in (None, LAMBDA_HANDLER_SCENES[0]):
+            raise Exception('throttled')
+        assert start == main.get_acquisition_date(name)
+        return pd.DataFrame({'reference': [name], 'secondary': ['sec1']})
+
+    mock_get_in_progress_pairs.side_effect = get_in_progress_pairs
+    mock_process_scene.side_effect = failing_process_scene
+
+    response = main.lambda_handler({'Records': lambda_handler_records()}, None)
+
+    assert response == {
+        'batchItemFailures': [
+            {'itemIdentifier': 'message5'},
+            {'itemIdentifier': 'message1'},
+            {'itemIdentifier': 'message2'},
+            {'itemIdentifier': 'message4'},
+        ]
+    }
+    # the boto3 DynamoDB resource isn't thread-safe, so each scene's search must happen before the scenes are processed
+    assert len(search_threads) == 4
+    assert all(thread is threading.main_thread() for thread in search_threads)
+
+    assert sorted(call.args[0] for call in mock_process_scene.call_args_list) == sorted(LAMBDA_HANDLER_SCENES[1:])
+    for call in mock_process_scene.call_args_list:
+        assert call.kwargs['in_progress_pairs'].reference.tolist() == [call.args[0]]
+
+
+@pytest.fixture(scope='module')
+def landsat_pairs_with_geometry(landsat_pairs):
+    return landsat_pairs.set_geometry([UNIT_SQUARE] * 3)
+
+
+@patch('main.get_key')
+def test_deduplicate_s3_pairs(mock_get_key, landsat_pairs_with_geometry):
+    landsat_pairs = landsat_pairs_with_geometry
 
     mock_get_key.side_effect = [None, None, None]
     pairs = main.deduplicate_s3_pairs(landsat_pairs)
@@ -122,111 +308,67 @@ def test_deduplicate_s3_pairs(mock_get_key):
 
     mock_get_key.side_effect = ['foo', 'bar', 'bazz']
     pairs = main.deduplicate_s3_pairs(landsat_pairs)
-    assert pairs.equals(landsat_pairs.drop(0).drop(1).drop(2))
+    assert pairs.equals(landsat_pairs.drop([0, 1, 2]))
 
 
 @patch('main.HYP3.submit_prepared_jobs')
-def test_submit_pairs_for_processing(mock_submit_prepared_jobs, hyp3_batch_factory):
-    sec_scenes = [
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        'LC08_L1TP_138041_20240112_20240123_02_T1',
-        'LC09_L1TP_138041_20240104_20240104_02_T1',
-    ]
-    ref_scenes = ['LC08_L1TP_138041_20240128_20240207_02_T1'] * 3
-
-    landsat_jobs = hyp3_batch_factory(zip(ref_scenes, sec_scenes))
-    landsat_pairs = gpd.GeoDataFrame({'reference': ref_scenes, 'secondary': sec_scenes})
-
-    mock_submit_prepared_jobs.side_effect = [landsat_jobs]
+def test_submit_pairs_for_processing(mock_submit_prepared_jobs, hyp3_batch_factory, landsat_pairs, landsat_jobs):
+    mock_submit_prepared_jobs.return_value = landsat_jobs
     jobs = main.submit_pairs_for_processing(landsat_pairs)
     assert jobs == landsat_jobs
 
+    jobs = main.submit_pairs_for_processing(landsat_pairs.iloc[0:0])
+    assert jobs == sdk.Batch()
+    mock_submit_prepared_jobs.assert_called_once()
 
-def test_query_jobs_by_status_code(tables):
-    its_live_user = 'hyp3.its_live'
+    many_ref_scenes = [f'reference_{ii}' for ii in range(450)]
+    many_sec_scenes = [f'secondary_{ii}' for ii in range(450)]
+    many_pairs = pd.DataFrame({'reference': many_ref_scenes, 'secondary': many_sec_scenes})
+    many_jobs = hyp3_batch_factory(zip(many_ref_scenes, many_sec_scenes))
 
-    table_items = [
-        {
-            'job_id': 'job1',
-            'user_id': its_live_user,
-            'status_code': 'PENDING',
-            'request_time': '2024-01-28T00:00:00+00:00',
-            'job_type': 'AUTORIFT',
-            'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
-        },
-        {
-            'job_id': 'job2',
-            'user_id': its_live_user,
-            'status_code': 'PENDING',
-            'request_time': '2024-01-29T00:00:00+00:00',
-            'job_type': 'AUTORIFT',
-            'name': 'LC09_L1TP_138041_20240120_20240120_02_T2',
-        },
-        {
-            'job_id': 'job3',
-            'user_id': its_live_user,
-            'status_code': 'PENDING',
-            'request_time': '2024-01-01T00:00:00+00:00',
-            'job_type': 'AUTORIFT',
-            'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
-        },
-        {
-            'job_id': 'job4',
-            'user_id': 'other-user',
-            'status_code': 'PENDING',
-            'request_time': '2024-01-29T00:00:00+00:00',
-            'job_type': 'AUTORIFT',
-            'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
-        },
-        {
-            'job_id': 'job5',
-            'user_id': 'other-user',
-            'status_code': 'RUNNING',
-            'request_time': '2024-01-29T00:00:00+00:00',
-            'job_type': 'AUTORIFT',
-            'name': 'LC09_L1TP_138041_20240120_20240120_02_T1',
-        },
-    ]
-
-    for item in table_items:
-        tables.jobs_table.put_item(Item=item)
-
-    jobs = main.query_jobs_by_status_code(
-        'PENDING',
-        its_live_user,
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        datetime.datetime.fromisoformat('2024-01-28T00:00:00+00:00'),
-    )
-    assert jobs == sdk.Batch([sdk.Job.from_dict(table_items[0])])
-
-    jobs = main.query_jobs_by_status_code(
-        'RUNNING',
-        'other-user',
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        datetime.datetime.fromisoformat('2024-01-01T00:00:00+00:00'),
-    )
-    assert jobs == sdk.Batch([sdk.Job.from_dict(table_items[4])])
-
-    jobs = main.query_jobs_by_status_code(
-        'PENDING',
-        its_live_user,
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        datetime.datetime.fromisoformat('2024-01-30T00:00:00+00:00'),
-    )
-    assert jobs == sdk.Batch([])
-
-    jobs = main.query_jobs_by_status_code(
-        'RUNNING',
-        its_live_user,
-        'LC09_L1TP_138041_20240120_20240120_02_T1',
-        datetime.datetime.fromisoformat('2024-01-28T00:00:00+00:00'),
-    )
-    assert jobs == sdk.Batch([])
-
-    jobs = main.query_jobs_by_status_code(
-        'SUCCEEDED',
-        'non-existant-user',
-        'non-existant-granule',
-        datetime.datetime.fromisoformat('2000-01-01T00:00:00+00:00'),
+    mock_submit_prepared_jobs.reset_mock()
+    jobs_by_reference = {job.job_parameters['granules'][0]: job for job in many_jobs}
+    mock_submit_prepared_jobs.side_effect = lambda prepared_jobs: sdk.Batch(
+        [jobs_by_reference[job['name']] for job in prepared_jobs]
     )
-    assert jobs == sdk.Batch([])
+    with patch('main.HYP3.prepare_autorift_job') as mock_prepare_autorift_job:
+        mock_prepare_autorift_job.side_effect = lambda reference, secondary, name: {
+            'name': name,
+            'job_parameters': {'granules': [reference, secondary]},
+        }
+        jobs = main.submit_pairs_for_processing(many_pairs)
+    assert mock_submit_prepared_jobs.call_count == 3
+    assert jobs == many_jobs
+
+
+@pytest.fixture(scope='module')
+def jobs_table(tables):
+    with tables.jobs_table.batch_writer() as batch:
+        for item in JOBS_TABLE_ITEMS:
+            batch.put_item(Item=item)
+    return tables.jobs_table
+
+
+@pytest.fixture(scope='module')
+def jobs_table_jobs():
+    return [sdk.Job.from_dict(item) for item in JOBS_TABLE_ITEMS]
+
+
+@pytest.mark.parametrize(
+    ('status_code', 'user', 'name', 'start', 'expected'),
+    [
+        ('PENDING', 'hyp3.its_live', 'LC09_L1TP_138041_20240120_20240120_02_T1', '2024-01-28T00:00:00+00:00', [0]),
+        ('RUNNING', 'other-user', 'LC09_L1TP_138041_20240120_20240120_02_T1', '2024-01-01T00:00:00+00:00', [4]),
+        ('PENDING', 'hyp3.its_live', 'LC09_L1TP_138041_20240120_20240120_02_T1', '2024-01-30T00:00:00+00:00', []),
+        ('RUNNING', 'hyp3.its_live', 'LC09_L1TP_138041_20240120_20240120_02_T1', '2024-01-28T00:00:00+00:00', []),
+        ('PENDING', 'hyp3.its_live', None, None, [0, 1, 2]),
+        ('SUCCEEDED', 'non-existant-user', 'non-existant-granule', '2000-01-01T00:00:00+00:00', []),
+    ],
+    ids=['pending', 'running', 'too-late', 'wrong-status', 'no-name-or-start', 'no-match'],
+)
+def test_query_jobs_by_status_code(jobs_table, jobs_table_jobs, status_code, user, name, start, expected):
+    if start is not None:
+        start = datetime.datetime.fromisoformat(start)
+
+    jobs = main.query_jobs_by_status_code(status_code, user, name, start)
+    assert sdk.Batch(sorted(jobs, key=lambda job: job.job_id)) == sdk.Batch([jobs_table_jobs[ii] for ii in expected])
@@ -6,6 +6,7 @@ import pystac
 import pytest
 import requests
 import responses
+from shapely.geometry import shape
 
 import sentinel2
 
@@ -40,112 +41,149 @@ def test_get_sentinel2_stac_item(mock_sentinel2_search, pystac_item_factory, sta
     date_time = '2020-03-15T15:22:59.024Z'
     expected_item = pystac_item_factory(id=scene, datetime=date_time, properties=properties, collection=collection)
 
-    mock_sentinel2_search.side_effect = [stac_search_factory([expected_item])]
+    mock_sentinel2_search.return_value = stac_search_factory([expected_item])
     item = sentinel2.get_sentinel2_stac_item(scene)
     assert item.collection_id == collection
     assert item.properties == properties
 
-    mock_sentinel2_search.side_effect = [stac_search_factory([])]
+    mock_sentinel2_search.return_value = stac_search_factory([])
     with pytest.raises(ValueError):
         _ = sentinel2.get_sentinel2_stac_item(scene)
 
 
-@patch('sentinel2.get_data_coverage_for_item')
-def test_qualifies_for_processing(mock_data_coverage_for_item, pystac_item_factory):
-    properties = {
+@pytest.fixture(scope='module')
+def sentinel2_properties():
+    return {
         'grid:code': 'MGRS-19DEE',
         'eo:cloud_cover': 30,
         's2:product_uri': 'S2B_MSIL1C_20240528T000000_N0510_R110_T22TCR_20240528T000000.SAFE',
         's2:product_type': 'S2MSI1C',
         'instruments': ['msi'],
     }
-    collection = 'sentinel-2-l1c'
-    good_item = pystac_item_factory(
-        id='XXX_XXXL1C_XXXX_XXXX_XXXX', datetime=datetime.now(), properties=properties, collection=collection
-    )
-
-    mock_data_coverage_for_item.side_effect = [75.0]
-    assert sentinel2.qualifies_for_sentinel2_processing(good_item)
-
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.collection_id = 'foo'
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['s2:product_type'] = 'S2MSI2A'
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
-
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['instruments'] = ['mis']
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['grid:code'] = 'MGRS-30BZZ'
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
+@pytest.mark.parametrize(
+    ('collection', 'overrides', 'qualifies'),
+    [
+        ('sentinel-2-l1c', {}, True),
+        ('foo', {}, False),
+        ('foo', {'grid:code': None}, False),
+        ('sentinel-2-l1c', {'s2:product_type': 'S2MSI2A'}, False),
+        ('sentinel-2-l1c', {'instruments': ['mis']}, False),
+        ('sentinel-2-l1c', {'grid:code': 'MGRS-30BZZ'}, False),
+        ('sentinel-2-l1c', {'eo:cloud_cover': None}, False),
+        ('sentinel-2-l1c', {'eo:cloud_cover': -1}, False),
+        ('sentinel-2-l1c', {'eo:cloud_cover': 0}, True),
+        ('sentinel-2-l1c', {'eo:cloud_cover': 1}, True),
+        ('sentinel-2-l1c', {'eo:cloud_cover': sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT - 1}, True),
+        ('sentinel-2-l1c', {'eo:cloud_cover': sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT}, True),
+        ('sentinel-2-l1c', {'eo:cloud_cover': sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT + 1}, False),
+    ],
+)
+@patch('sentinel2.get_data_coverage_for_item')
+def test_qualifies_for_processing(
+    mock_data_coverage_for_item, pystac_item_factory, sentinel2_properties, collection, overrides, qualifies
+):
+    # an override of None removes the property from the item
+    properties = {key: value for key, value in (sentinel2_properties | overrides).items() if value is not None}
+    item = pystac_item_factory(
+        id='XXX_XXXL1C_XXXX_XXXX_XXXX', datetime=datetime.now(), properties=properties, collection=collection
+    )
+    mock_data_coverage_for_item.return_value = 75.0
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    del item.properties['eo:cloud_cover']
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
+    assert sentinel2.qualifies_for_sentinel2_processing(item) is qualifies
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = -1
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = 0
-    assert sentinel2.qualifies_for_sentinel2_processing(item)
+@patch('sentinel2.get_data_coverage_for_item')
+def test_qualifies_for_processing_data_coverage(mock_data_coverage_for_item, pystac_item_factory, sentinel2_properties):
+    item = pystac_item_factory(
+        id='XXX_XXXL1C_XXXX_XXXX_XXXX',
+        datetime=datetime.now(),
+        properties=sentinel2_properties,
+        collection='sentinel-2-l1c',
+    )
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = 1
+    mock_data_coverage_for_item.return_value = 75.0
     assert sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT - 1
-    assert sentinel2.qualifies_for_sentinel2_processing(item)
+    mock_data_coverage_for_item.return_value = 50.0
+    assert not sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT
-    assert sentinel2.qualifies_for_sentinel2_processing(item)
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    item.properties['eo:cloud_cover'] = sentinel2.SENTINEL2_MAX_CLOUD_COVER_PERCENT + 1
-    assert not sentinel2.qualifies_for_sentinel2_processing(item)
+@pytest.fixture(scope='module')
+def sentinel2_pair_properties():
+    return {
+        'eo:cloud_cover': 28.1884,
+        'grid:code': 'MGRS-13CES',
+        's2:product_uri': 'S2B_MSIL1C_20240528T000000_N0510_R110_T22TCR_20240528T000000.SAFE',
+        's2:product_type': 'S2MSI1C',
+        'instruments': ['msi'],
+    }
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    item = deepcopy(good_item)
-    assert sentinel2.qualifies_for_sentinel2_processing(item, relative_orbit='R110')
 
-    mock_data_coverage_for_item.side_effect = [75.0]
-    assert not sentinel2.qualifies_for_sentinel2_processing(item, relative_orbit='R100')
+@pytest.fixture
+def sentinel2_sec_items(pystac_item_factory, sentinel2_pair_properties):
+    sec_scenes = [
+        'S2B_22TCR_20240528_0_L1C',
+        'S2B_22TCR_20230528_0_L1C',
+        'S2B_22TCR_20210528_0_L1C',
+    ]
+    sec_date_times = [
+        datetime(2024, 5, 28, 0, 0, 0, 0, tzinfo=UTC),
+        datetime(2023, 5, 28, 0, 0, 0, tzinfo=UTC),
+        datetime(2021, 5, 28, 0, 0, 0, 0, tzinfo=UTC),
+    ]
+    sec_geometries = [
+        {
+            'type': 'Polygon',
+            'coordinates': [
+                [
+                    [-52.15438338757846, 45.48626501919109],
+                    [-52.16589191027769, 46.0476276229589],
+                    [-53.58406512039718, 46.02435339629007],
+                    [-53.57322833884183, 45.7857967705479],
+                    [-52.15438338757846, 45.48626501919109],
+                ]
+            ],
+        },
+        None,
+        None,
+    ]
+    sec_items = [
+        pystac_item_factory(
+            id=scene,
+            datetime=date_time,
+            properties=sentinel2_pair_properties,
+            collection='sentinel-2-l1c',
+            geometry=geometry,
+        )
+        for scene, date_time, geometry in zip(sec_scenes, sec_date_times, sec_geometries)
+    ]
 
-    mock_data_coverage_for_item.side_effect = [50.0]
-    assert not sentinel2.qualifies_for_sentinel2_processing(good_item)
+    # different relative orbit (R100) than the reference scene (R110)
+    sec_items.append(
+        pystac_item_factory(
+            id='S2B_22TCR_20220528_0_L1C',
+            datetime=datetime(2022, 5, 28, 0, 0, 0, tzinfo=UTC),
+            properties=sentinel2_pair_properties
+            | {'s2:product_uri': 'S2B_MSIL1C_20220528T000000_N0510_R100_T22TCR_20220528T000000.SAFE'},
+            collection='sentinel-2-l1c',
+        )
+    )
+    return sec_items
 
 
 @patch('sentinel2.SENTINEL2_CATALOG.search')
 @patch('sentinel2.get_data_coverage_for_item')
 def test_get_sentinel2_pairs_for_reference_scene(
-    mock_data_coverage_for_item, mock_sentinel2_search, pystac_item_factory, stac_search_factory
+    mock_data_coverage_for_item,
+    mock_sentinel2_search,
+    pystac_item_factory,
+    stac_search_factory,
+    sentinel2_pair_properties,
+    sentinel2_sec_items,
 ):
     scene = 'S2B_22TCR_20240528_0_L1C'
-    properties = {
-        'eo:cloud_cover': 28.1884,
-        'grid:code': 'MGRS-13CES',
-        's2:product_uri': 'S2B_MSIL1C_20240528T000000_N0510_R110_T22TCR_20240528T000000.SAFE',
-        's2:product_type': 'S2MSI1C',
-        'instruments': ['msi'],
-    }
     collection = 'sentinel-2-l1c'
     date_time = '2024-05-28T00:00:00.000Z'
     geometry = {
@@ -184,34 +222,23 @@ def test_get_sentinel2_pairs_for_reference_scene(
         ],
     }
     ref_item = pystac_item_factory(
-        id=scene, datetime=date_time, properties=properties, collection=collection, geometry=geometry
+        id=scene, datetime=date_time, properties=sentinel2_pair_properties, collection=collection, geometry=geometry
     )
-    sec_scenes = [
-        'S2B_22TCR_20240528_0_L1C',
-        'S2B_22TCR_20230528_0_L1C',
-        'S2B_22TCR_20210528_0_L1C',
-    ]
-    sec_date_times = [
-        datetime(2024, 5, 28, 0, 0, 0, 0, tzinfo=UTC),
-        datetime(2023, 5, 28, 0, 0, 0, tzinfo=UTC),
-        datetime(2021, 5, 28, 0, 0, 0, 0, tzinfo=UTC),
-    ]
-    sec_items = []
-    for scene, date_time in zip(sec_scenes, sec_date_times):
-        props = deepcopy(properties)
-        sec_items.append(pystac_item_factory(id=scene, datetime=date_time, properties=props, collection=collection))
 
-    mock_sentinel2_search.side_effect = [stac_search_factory(sec_items)]
-    mock_data_coverage_for_item.side_effect = [75.0, 75.0, 75.0]
+    mock_sentinel2_search.return_value = stac_search_factory(sentinel2_sec_items)
+    mock_data_coverage_for_item.return_value = 75.0
     df = sentinel2.get_sentinel2_pairs_for_reference_scene(ref_item)
 
+    assert mock_sentinel2_search.call_args.kwargs['limit'] == sentinel2.SENTINEL2_CATALOG_PAGE_SIZE
+    assert len(df) == 3
     assert (df['grid:code'] == ref_item.properties['grid:code']).all()
-    for instrument in df['instruments']:
-        assert instrument == ref_item.properties['instruments']
+    assert (df['instruments'].str.join(',') == ','.join(ref_item.properties['instruments'])).all()
     assert (df['reference_acquisition'] == ref_item.datetime).all()
+    assert df.crs == 'EPSG:4326'
+    assert df.geometry.iloc[0].equals(shape(sentinel2_sec_items[0].geometry))
+    assert df.geometry.iloc[1:].isna().all()
 
 
-@responses.activate
 def test_get_data_coverage_for_item(pystac_item_factory):
     tile_path = 'sentinel-s2-l1c/tiles/13/C/ES/2024/5/28/0/tileInfo.json'
     assets = {'tileinfo_metadata': pystac.Asset(href=f's3://{tile_path}')}
@@ -221,10 +248,14 @@ def test_get_data_coverage_for_item(pystac_item_factory):
     item_roda = deepcopy(item_s3)
     item_roda.assets = {'tileinfo_metadata': pystac.Asset(href=f'https://roda.sentinel-hub.com/{tile_path}')}
     url = f'https://roda.sentinel-hub.com/{tile_path}'
+    sentinel2.get_data_coverage_for_tile_info.cache_clear()
     with responses.RequestsMock() as rsps:
         rsps.add(responses.GET, url, json={'dataCoveragePercentage': 99.0}, status=200)
         assert sentinel2.get_data_coverage_for_item(item_s3) == 99.0
         assert sentinel2.get_data_coverage_for_item(item_roda) == 99.0
+        assert len(rsps.calls) == 1
+
+        sentinel2.get_data_coverage_for_tile_info.cache_clear()
         rsps.add(responses.GET, url, status=404)
         with pytest.raises(requests.HTTPError):
             sentinel2.get_data_coverage_for_item(item_s3)
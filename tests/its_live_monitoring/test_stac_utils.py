@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+from shapely.geometry import shape
+
+import stac_utils
+
+
+@patch('stac_utils.pystac_client.Client.open')
+def test_open_stac_catalog(mock_open):
+    catalog = stac_utils.open_stac_catalog('https://example.com/stac')
+
+    assert catalog is mock_open.return_value
+    assert mock_open.call_args.args == ('https://example.com/stac',)
+
+    retry = mock_open.call_args.kwargs['stac_io'].session.get_adapter('https://').max_retries
+    assert retry.total == 5
+    assert set(retry.allowed_methods) == {'GET', 'POST'}
+    assert 429 in retry.status_forcelist
+
+
+def test_geometries_from_geojson():
+    polygon = {'type': 'Polygon', 'coordinates': [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]]}
+
+    geometries = stac_utils.geometries_from_geojson([polygon, None])
+
+    assert len(geometries) == 2
+    assert geometries[0].equals(shape(polygon))
+    assert geometries[1] is None
+
+    assert len(stac_utils.geometries_from_geojson([])) == 0
@@ -0,0 +1,40 @@
+import io
+import json
+import urllib.error
+from unittest.mock import patch
+
+import pytest
+
+import status_messages
+
+
+@patch('status_messages.urllib.request.urlopen')
+def test_create_post(mock_urlopen):
+    mock_urlopen.return_value.__enter__.return_value = io.BytesIO(b'{"id": "post1"}')
+
+    assert status_messages.create_post('hello') == {'id': 'post1'}
+
+    mock_urlopen.assert_called_once()
+    request = mock_urlopen.call_args.args[0]
+    assert request.full_url == 'https://chat.asf.alaska.edu/api/v4/posts'
+    assert request.get_method() == 'POST'
+    assert request.get_header('Authorization') == 'Bearer test-token'
+    assert request.get_header('Content-type') == 'application/json'
+    assert json.loads(request.data) == {'channel_id': status_messages.MATTERMOST_CHANNEL_ID, 'message': 'hello'}
+    assert mock_urlopen.call_args.kwargs == {'timeout': 5}
+
+
+@patch('status_messages.get_queue_count')
+@patch('status_messages.urllib.request.urlopen')
+def test_lambda_handler_post_failure(mock_urlopen, mock_get_queue_count):
+    mock_get_queue_count.return_value = '3'
+    mock_urlopen.side_effect = urllib.error.HTTPError(
+        status_messages.MATTERMOST_POSTS_URL, 401, 'Unauthorized', hdrs=None, fp=None
+    )
+
+    with pytest.raises(urllib.error.HTTPError):
+        status_messages.lambda_handler({}, {})
+
+    message = json.loads(mock_urlopen.call_args.args[0].data)['message']
+    assert message.startswith(f'{status_messages.NONEMPTY_QUEUE_EMOJI} Dead Letter Queue Count for ')
+    assert ' has 3 entries on ' in message